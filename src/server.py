@@ -5,26 +5,78 @@ Live Reload Server - A simple HTTP server with auto-reload for static web develo
 
 import argparse
 import asyncio
+import email.utils
 import os
 import sys
 import mimetypes
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+import shutil
+import socket
+import tempfile
+import weakref
+from functools import lru_cache
+from datetime import timezone
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
 from pathlib import Path
-from threading import Thread
+from threading import Lock, Thread, Timer
 
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
+from watchdog.events import (
+    FileCreatedEvent, FileDeletedEvent, FileModifiedEvent, FileMovedEvent,
+    FileSystemEventHandler,
+)
 import websockets
 
-# WebSocket clients (browsers to notify)
-clients = set()
+# WebSocket clients (browsers to notify); closed connections drop out on
+# their own once websockets lets go of them
+clients = weakref.WeakSet()
 ws_port = None
 
+# The one message ever sent to browsers
+RELOAD_MESSAGE = "reload"
+
+# Tags the live reload script is spliced in front of
+BODY_NEEDLE = b'</body>'
+HEAD_NEEDLE = b'</head>'
+
+# Pages carrying this marker already have the script and are served as-is
+INJECTED_MARKER = b'<!--__livereload_injected__-->'
+
+# File types that trigger a browser reload
+WATCHED_EXTS = frozenset({'.html', '.htm', '.css', '.js', '.json'})
+
+# URL path -> filesystem path, cleared wholesale once it reaches the cap
+_PATH_CACHE = {}
+PATH_CACHE_SIZE = 1024
+
+# Reload window: the first file event opens one, and browsers reload when it
+# closes. Events inside a window fold into one more reload a window later.
+DEBOUNCE_DELAY = 0.3
+
+# Injected HTML responses keyed by path -> (st_mtime_ns, st_size, length, body).
+# With sendfile the body is a _ParkedBody, otherwise plain bytes. Pages that
+# already carry the script are cached with body None. Cleared wholesale once it
+# reaches the cap, like _PATH_CACHE.
+_HTML_CACHE = {}
+HTML_CACHE_SIZE = 128
+
+# Zero-copy static file transfer (Linux/BSD/macOS)
+HAS_SENDFILE = hasattr(os, 'sendfile')
+SENDFILE_CHUNK = 65536
+
+# Userspace copy size for static assets when sendfile can't be used.
+# SO_SNDBUF is left alone: setting it disables the kernel's send-buffer autotuning.
+COPY_BUFFER_SIZE = 256 * 1024
+
+# Hold back partial segments so headers and body share TCP packets
+# (TCP_CORK on Linux, TCP_NOPUSH on BSD/macOS)
+TCP_CORK = getattr(socket, 'TCP_CORK', None) or getattr(socket, 'TCP_NOPUSH', None)
+
 # Live reload script to inject into HTML
 LIVE_RELOAD_SCRIPT = '''
+<!--__livereload_injected__-->
 <script>
 (function() {
-    const ws = new WebSocket('ws://localhost:PORT_PLACEHOLDER');
+    const ws = new WebSocket('ws://' + location.hostname + ':PORT_PLACEHOLDER');
     ws.onopen = () => console.log('[Live Reload] Connected');
     ws.onmessage = () => {
         console.log('[Live Reload] Reloading...');
@@ -36,101 +88,336 @@ LIVE_RELOAD_SCRIPT = '''
 '''
 
 
+def _park_body(chunks):
+    """Move injected HTML into an anonymous file so it can be sendfile()d.
+    
+    Returns (length, body); body is plain bytes where sendfile is missing.
+    """
+    if not HAS_SENDFILE:
+        content = b''.join(chunks)
+        return len(content), content
+    if hasattr(os, 'memfd_create'):
+        body = os.fdopen(os.memfd_create('livereload-html'), 'w+b')
+    else:
+        body = tempfile.TemporaryFile()
+    body.writelines(chunks)
+    body.flush()
+    return body.tell(), _ParkedBody(body)
+
+
+class _ParkedBody:
+    """Anonymous file holding one injected page.
+    
+    Closed once the cache and every response still sending from it let go,
+    so evicting an entry never pulls the fd out from under another thread.
+    """
+    
+    def __init__(self, file):
+        self.file = file
+    
+    def fileno(self):
+        return self.file.fileno()
+    
+    def __del__(self):
+        self.file.close()
+
+
+def _make_etag(st, length, *salt):
+    """Weak validator from inode, response length and mtime (plus any salt)."""
+    parts = [st.st_ino, length, st.st_mtime_ns, *salt]
+    return 'W/"%s"' % '-'.join(format(part, 'x') for part in parts)
+
+
+@lru_cache(maxsize=256)
+def _guess_type(ext):
+    """Mimetype for a (lowercased) file extension, resolved once per extension."""
+    if ext in SimpleHTTPRequestHandler.extensions_map:
+        return SimpleHTTPRequestHandler.extensions_map[ext]
+    guess, _ = mimetypes.guess_type('file' + ext)
+    return guess or 'application/octet-stream'
+
+
 class ReloadHandler(FileSystemEventHandler):
     """Watchdog handler that triggers browser reload on file changes."""
     
     def __init__(self, loop):
         self.loop = loop
-        self.debounce_timer = None
+        self._lock = Lock()
+        self._timer = None
+        self._pending = False
     
     def on_modified(self, event):
-        if event.is_directory:
-            return
-        if event.src_path.endswith(('.html', '.htm', '.css', '.js', '.json')):
-            print(f"[Watch] File changed: {event.src_path}")
-            self._trigger_reload()
+        self._handle("changed", event.src_path)
     
     def on_created(self, event):
-        if event.is_directory:
+        self._handle("created", event.src_path)
+    
+    def on_deleted(self, event):
+        self._handle("deleted", event.src_path)
+    
+    def on_moved(self, event):
+        # Also covers editors that save by renaming a temp file over the page
+        self._handle("moved", event.src_path, event.dest_path)
+    
+    def _handle(self, verb, *paths):
+        for path in paths:
+            _HTML_CACHE.pop(path, None)
+        if not any(os.path.splitext(path)[1] in WATCHED_EXTS for path in paths):
             return
-        if event.src_path.endswith(('.html', '.htm', '.css', '.js', '.json')):
-            print(f"[Watch] File created: {event.src_path}")
-            self._trigger_reload()
+        print(f"[Watch] File {verb}: {' -> '.join(paths)}")
+        self._trigger_reload()
     
     def _trigger_reload(self):
-        # Debounce to avoid multiple rapid reloads
-        if self.debounce_timer:
-            self.debounce_timer.cancel()
-        self.debounce_timer = asyncio.run_coroutine_threadsafe(
-            self._notify_clients(), self.loop
-        )
-    
-    async def _notify_clients(self):
-        await asyncio.sleep(0.1)  # Small debounce delay
+        # Debounce on the watcher thread: at most one reload per window
+        with self._lock:
+            if self._timer is not None:
+                self._pending = True
+                return
+            self._start_timer()
+    
+    def _start_timer(self):
+        self._timer = Timer(DEBOUNCE_DELAY, self._fire)
+        self._timer.daemon = True
+        self._timer.start()
+    
+    def _fire(self):
+        # clients belongs to the event loop thread, so broadcast from there
+        self.loop.call_soon_threadsafe(self._notify_clients)
+        with self._lock:
+            if self._pending:
+                # More events arrived during the window, reload once more after
+                # the next one so a steady stream can't hold reloads back
+                self._pending = False
+                self._start_timer()
+            else:
+                self._timer = None
+    
+    def _notify_clients(self):
         if clients:
             print(f"[Live Reload] Notifying {len(clients)} client(s) to reload...")
-            disconnected = set()
-            for ws in clients:
-                try:
-                    await ws.send("reload")
-                except:
-                    disconnected.add(ws)
-            clients.difference_update(disconnected)
+            # Writes to every open connection without awaiting any of them
+            websockets.broadcast(clients, RELOAD_MESSAGE)
 
 
 class LiveReloadRequestHandler(SimpleHTTPRequestHandler):
     """HTTP handler that injects live-reload script into HTML responses."""
     
+    # Encoded live reload script, filled in by main() once ws_port is known
+    SCRIPT_BYTES = b''
+    
     def __init__(self, *args, ws_port=None, **kwargs):
         self.ws_port = ws_port
         super().__init__(*args, **kwargs)
     
+    def setup(self):
+        super().setup()
+        try:
+            # No Nagle delay on the tail of a response once the cork is pulled
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass  # Not a TCP socket
+        self._set_cork(True)
+    
+    def _set_cork(self, enabled):
+        if TCP_CORK is None:
+            return
+        try:
+            self.connection.setsockopt(socket.IPPROTO_TCP, TCP_CORK, int(enabled))
+        except OSError:
+            pass  # Not a TCP socket
+    
+    def translate_path(self, path):
+        key = (self.directory, path)
+        fs_path = _PATH_CACHE.get(key)
+        if fs_path is None:
+            if len(_PATH_CACHE) >= PATH_CACHE_SIZE:
+                _PATH_CACHE.clear()
+            fs_path = _PATH_CACHE[key] = super().translate_path(path)
+        return fs_path
+    
+    def guess_type(self, path):
+        return _guess_type(os.path.splitext(path)[1].lower())
+    
     def do_GET(self):
         # Get the file path
         path = self.translate_path(self.path)
         
         # Check if it's an HTML file
-        if path.endswith('.html') or path.endswith('.htm'):
-            if os.path.exists(path):
-                self._serve_html_with_reload(path)
-                return
+        st = self._stat_html(path)
+        if st is not None and self._serve_html_with_reload(path, st):
+            return
         
         # Fall back to default handler
         super().do_GET()
     
-    def _serve_html_with_reload(self, path):
+    def do_HEAD(self):
+        # HTML headers must describe the injected body that GET would send
+        path = self.translate_path(self.path)
+        st = self._stat_html(path)
+        if st is not None and self._serve_html_with_reload(path, st, send_body=False):
+            return
+        
+        super().do_HEAD()
+    
+    def _stat_html(self, path):
+        if not (path.endswith('.html') or path.endswith('.htm')):
+            return None
         try:
-            with open(path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # Inject the live reload script before </body> or </head>
-            script = LIVE_RELOAD_SCRIPT.replace('PORT_PLACEHOLDER', str(self.ws_port))
+            return os.stat(path)
+        except OSError:
+            return None
+    
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if path.endswith('/') or os.path.isdir(path):
+            # Directory redirects, index pages and listings
+            return super().send_head()
+        
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.send_error(404, "File not found")
+            return None
+        
+        try:
+            st = os.fstat(f.fileno())
+            etag = _make_etag(st, st.st_size)
+            if self._is_not_modified(etag, st):
+                f.close()
+                self._send_not_modified(etag)
+                return None
             
-            if '</body>' in content:
-                content = content.replace('</body>', script + '</body>')
-            elif '</head>' in content:
-                content = content.replace('</head>', script + '</head>')
+            self.send_response(200)
+            self.send_header('Content-Type', self.guess_type(path))
+            self.send_header('Content-Length', str(st.st_size))
+            self._send_validators(etag, st)
+            self.end_headers()
+            return f
+        except:
+            f.close()
+            raise
+    
+    def _is_not_modified(self, etag, st):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags
+        
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is None:
+            return False
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, IndexError, OverflowError, ValueError):
+            return False  # Ignore ill-formed values
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return int(st.st_mtime) <= since.timestamp()
+    
+    def _send_validators(self, etag, st):
+        # no-cache: always revalidate, so edits show up on the next reload
+        self.send_header('Last-Modified', self.date_time_string(st.st_mtime))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+    
+    def _send_not_modified(self, etag):
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self._set_cork(False)
+    
+    def _serve_html_with_reload(self, path, st, send_body=True):
+        # Returns False when the page already has the script; the caller then
+        # serves the file untouched through send_head/copyfile (sendfile).
+        try:
+            cached = _HTML_CACHE.get(path)
+            if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+                length, body = cached[2:]
             else:
-                # Just append if no body/head closing tag
-                content += script
+                chunks = self._inject_reload_script(path)
+                length, body = _park_body(chunks) if chunks else (0, None)
+                if len(_HTML_CACHE) >= HTML_CACHE_SIZE:
+                    _HTML_CACHE.clear()
+                _HTML_CACHE[path] = (st.st_mtime_ns, st.st_size, length, body)
+            
+            if body is None:
+                return False
+            
+            # The injected script depends on the WebSocket port as well
+            etag = _make_etag(st, length, self.ws_port)
+            if self._is_not_modified(etag, st):
+                self._send_not_modified(etag)
+                return True
             
             # Send response
             self.send_response(200)
             self.send_header('Content-Type', 'text/html; charset=utf-8')
-            self.send_header('Content-Length', len(content.encode('utf-8')))
+            self.send_header('Content-Length', length)
+            self._send_validators(etag, st)
             self.end_headers()
-            self.wfile.write(content.encode('utf-8'))
+            if send_body and isinstance(body, bytes):
+                self.wfile.write(body)
+            elif send_body:
+                self._sendfile(body, self.wfile)
+            self._set_cork(False)
             
         except Exception as e:
             self.send_error(500, str(e))
+        return True
+    
+    def _inject_reload_script(self, path):
+        with open(path, 'rb') as f:
+            raw = f.read()
+        
+        if INJECTED_MARKER in raw:
+            return None
+        
+        # Splice the live reload script in before </body> or </head>
+        idx = raw.rfind(BODY_NEEDLE)
+        if idx == -1:
+            idx = raw.rfind(HEAD_NEEDLE)
+        if idx == -1:
+            # Just append if no body/head closing tag
+            idx = len(raw)
+        
+        # Zero-copy views, so the spliced page is never built in memory
+        view = memoryview(raw)
+        return view[:idx], self.SCRIPT_BYTES, view[idx:]
+    
+    def copyfile(self, source, outputfile):
+        # Stream static assets straight from the page cache to the socket.
+        # HTML never gets here: it is served by _serve_html_with_reload.
+        try:
+            if not (HAS_SENDFILE and self._sendfile(source, outputfile)):
+                shutil.copyfileobj(source, outputfile, COPY_BUFFER_SIZE)
+        finally:
+            # Body is complete, push out whatever the cork is holding
+            self._set_cork(False)
+    
+    def _sendfile(self, source, outputfile):
+        try:
+            in_fd = source.fileno()
+            out_fd = outputfile.fileno()
+        except (AttributeError, OSError, ValueError):
+            return False  # Not a real file/socket (e.g. TLS or in-memory stream)
+        
+        outputfile.flush()
+        offset = 0
+        while True:
+            sent = os.sendfile(out_fd, in_fd, offset, SENDFILE_CHUNK)
+            if sent == 0:
+                break
+            offset += sent
+        return True
     
     def log_message(self, format, *args):
         # Custom logging
         print(f"[HTTP] {self.address_string()} - {format % args}")
 
 
-class CustomHTTPServer(HTTPServer):
-    """Custom HTTP server that passes ws_port to handler."""
+class CustomHTTPServer(ThreadingHTTPServer):
+    """Threaded HTTP server that passes ws_port to handler."""
     
     def __init__(self, *args, ws_port=None, **kwargs):
         self.ws_port = ws_port
@@ -140,33 +427,31 @@ class CustomHTTPServer(HTTPServer):
         self.RequestHandlerClass(request, client_address, self, ws_port=self.ws_port)
 
 
-async def websocket_server(port):
+async def websocket_server(host, port):
     """WebSocket server to notify browsers to reload."""
     
-    async def handler(websocket, path):
+    async def handler(websocket, path=None):
         clients.add(websocket)
         print(f"[WebSocket] Client connected (total: {len(clients)})")
-        try:
-            await websocket.wait_closed()
-        finally:
-            clients.discard(websocket)
-            print(f"[WebSocket] Client disconnected (total: {len(clients)})")
+        await websocket.wait_closed()
+        print("[WebSocket] Client disconnected")
     
-    async with websockets.serve(handler, "localhost", port):
-        print(f"[WebSocket] Server running on ws://localhost:{port}")
+    # Messages are a few bytes, so skip per-connection permessage-deflate state
+    async with websockets.serve(handler, host, port, compression=None):
+        print(f"[WebSocket] Server running on ws://{host}:{port}")
         await asyncio.Future()  # Run forever
 
 
-def start_websocket_server(port):
-    """Start WebSocket server in a separate thread."""
-    asyncio.run(websocket_server(port))
-
-
 def start_file_watcher(directory, loop):
     """Start file watcher in a separate thread."""
     event_handler = ReloadHandler(loop)
     observer = Observer()
-    observer.schedule(event_handler, directory, recursive=True)
+    # Only file modify/create/delete/move events are delivered; directory and
+    # open/close events are dropped by the emitter (or inotify itself)
+    observer.schedule(
+        event_handler, directory, recursive=True,
+        event_filter=[FileModifiedEvent, FileCreatedEvent, FileDeletedEvent, FileMovedEvent],
+    )
     observer.start()
     print(f"[Watch] Monitoring files in: {directory}")
     return observer
@@ -214,12 +499,17 @@ def main():
     global ws_port_global
     ws_port_global = ws_port
     
+    # Specialize the injected script for this port once, not per request
+    LiveReloadRequestHandler.SCRIPT_BYTES = (
+        LIVE_RELOAD_SCRIPT.replace('PORT_PLACEHOLDER', str(ws_port)).encode('utf-8')
+    )
+    
     print("=" * 50)
     print("  Live Reload Server")
     print("=" * 50)
     print(f"  Serving:    {serve_directory}")
     print(f"  HTTP:       http://{args.host}:{args.port}")
-    print(f"  WebSocket:  ws://localhost:{ws_port}")
+    print(f"  WebSocket:  ws://{args.host}:{ws_port}")
     print("=" * 50)
     print("  Press Ctrl+C to stop")
     print("")
@@ -231,25 +521,27 @@ def main():
     # Start file watcher
     observer = start_file_watcher(serve_directory, loop)
     
-    # Start WebSocket server in a thread
-    ws_thread = Thread(target=start_websocket_server, args=(ws_port,), daemon=True)
-    ws_thread.start()
-    
-    # Create HTTP server
-    def handler_factory(*args, **kwargs):
-        return LiveReloadRequestHandler(*args, ws_port=ws_port, **kwargs)
+    # Create HTTP server (CustomHTTPServer hands ws_port to each handler)
+    httpd = CustomHTTPServer((args.host, args.port), LiveReloadRequestHandler, ws_port=ws_port)
+    http_thread = Thread(target=httpd.serve_forever, daemon=True)
+    http_thread.start()
+    print(f"[HTTP] Server running on http://{args.host}:{args.port}")
     
-    httpd = CustomHTTPServer((args.host, args.port), handler_factory, ws_port=ws_port)
+    # WebSocket server runs on the same loop the file watcher targets
+    ws_task = loop.create_task(websocket_server(args.host, ws_port))
     
     try:
-        print(f"[HTTP] Server running on http://{args.host}:{args.port}")
-        httpd.serve_forever()
+        loop.run_until_complete(ws_task)
     except KeyboardInterrupt:
         print("\n[Server] Shutting down...")
     finally:
         observer.stop()
         observer.join()
+        httpd.shutdown()
         httpd.server_close()
+        ws_task.cancel()
+        loop.run_until_complete(asyncio.gather(ws_task, return_exceptions=True))
+        loop.close()
         print("[Server] Goodbye!")
 
 